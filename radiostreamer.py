@@ -32,6 +32,15 @@ import subprocess
 from datetime import datetime
 import logging
 import csv
+import io
+import json
+import queue
+import shutil
+import tempfile
+import threading
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+from http.client import HTTPException
 
 import tkinter as tk
 from tkinter.filedialog import askopenfilename, asksaveasfilename
@@ -44,6 +53,12 @@ from tkinter.messagebox import askokcancel
 #TODO:  create a confuguration file so this starts up each time with
 # the options in force when the program was last closed.
 PLYLISTFN = 'plylist.csv'
+PLYLISTURL = None    # e.g. 'http://radioserver.local:8000/plylist.csv'
+PLYLISTCACHE = 'plylist_cache.csv'
+SYNC_TIMEOUT = 5     # seconds
+SYNC_INTERVAL = 15 * 60 * 1000    # milliseconds between checks for updates
+IO_CHUNK_ROWS = 100  # rows read or written between progress reports
+IO_POLL_INTERVAL = 100    # milliseconds between checks on playlist load / save
 PROGPATH = 'C:/Program Files (x86)/VideoLAN/VLC/vlc.exe'
 PLAYER_CMD = "cvlc"
 LOG_FILENAME = 'logging.txt'
@@ -283,58 +298,172 @@ class SelectItemDialog(tk.Toplevel):
         # Can put dialog closing code in here.
         self.destroy()
 
+class PlaylistWorker(threading.Thread):
+    '''Runs a playlist load or save off the Tk thread.
+
+    The job is called as job(*args, progress=..., cancel=...).  Progress
+    reports and a final ('done', result) message are posted to the messages
+    queue, which the GUI drains from after() callbacks, since tkinter should
+    only be touched from the Tk thread.
+
+    Cancelling only takes effect between chunks of IO_CHUNK_ROWS rows, so a
+    job stuck in a read or write on a hung share can not be cancelled.  The
+    thread is a daemon, so such a job does not keep the program from
+    exiting.  Saves go through a temporary file, so killing one is safe.
+    '''
+    def __init__(self, label, job, *args):
+        threading.Thread.__init__(self, name='PlaylistIO', daemon=True)
+        self.label = label      # e.g. 'Loading', for progress messages
+        self.job = job
+        self.args = args
+        self.result = None
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.job(*self.args, progress=self._progress,
+                                   cancel=self.cancelled)
+        finally:
+            self.messages.put(('done', self.result))
+
+    def _progress(self, count):
+        self.messages.put(('progress', count))
+
+    def cancel(self):
+        '''Ask the job to stop at the end of the current chunk.'''
+        self.cancelled.set()
+
 class Playlist_manager():
     ''' Simple Playlist Manager Class.
     This class manages a playlist, alowing loading, editing, and saving simple
     CSV file playlists.
 
     The loaded or altered playlist is accessible as an attribute of the manager.
+
+    If a url is given, the manager subscribes to a playlist served over HTTP
+    instead of reading fn.  The last copy fetched is cached locally, so the
+    manager can start up from the cache when the server can not be reached.
     '''
-    def __init__(self, fn=PLYLISTFN, fdir=None):
+    def __init__(self, fn=PLYLISTFN, fdir=None, url=None):
         self.plname = fn
         self.pldir = fdir
+        self.url = url
         if self.pldir is not None:
             self.plpath = os.path.join(self.pldir, self.plname)
+            self.cachepath = os.path.join(self.pldir, PLYLISTCACHE)
         else:
             self.plpath = self.plname
-        self.playlist = self.playlist_from_path(self.plpath)
+            self.cachepath = PLYLISTCACHE
+        self.metapath = os.path.splitext(self.cachepath)[0] + '.json'
+        if self.url is None:
+            self.playlist = self.playlist_from_path(self.plpath)
+        else:
+            # Start up from the cache.  Bringing it up to date is left to
+            # sync_playlist or start_sync, so startup never waits on the server.
+            self.playlist = []
+            if os.path.isfile(self.cachepath):
+                self.playlist = self.playlist_from_path(self.cachepath) or []
 
-    def playlist_from_path(self, path):
+    def playlist_from_path(self, path, progress=None, cancel=None):
         '''Load a playlist from a file and return it.
-        This does NOT alter the active playlist of the Playlist Manager'''
+        This does NOT alter the active playlist of the Playlist Manager.
+
+        Rows are read in chunks of IO_CHUNK_ROWS.  After each chunk,
+        progress (if given) is called with the number of rows read so far,
+        and loading stops, returning None, if the cancel Event is set.'''
         # We keep a plylist as part of the manager principally to
         # enable us to edit the active playlist without loading.
         plylist = []
         try:
-            with open(path, 'r') as f:
+            with open(path, 'r', encoding='utf-8-sig') as f:
                 rdr = csv.DictReader(f)
                 for row in rdr:
                     plylist.append(row)
+                    if len(plylist) % IO_CHUNK_ROWS == 0:
+                        if cancel is not None and cancel.is_set():
+                            logger.debug('Playlist load cancelled.')
+                            return None
+                        if progress is not None:
+                            progress(len(plylist))
+            if progress is not None:
+                progress(len(plylist))
             return plylist
-        except IOError:
+        except (IOError, csv.Error, UnicodeDecodeError):
             logger.warning('Can not open selected playlist.')
             return None
 
+    def playlist_to_path(self, path, playlist=None, progress=None, cancel=None):
+        '''Write a playlist (by default the active one) to a CSV file.
+
+        The rows go to a temporary file beside path, which then replaces
+        path, so a crash part way through can not leave a truncated playlist.
+        progress and cancel work as for playlist_from_path.
+        Returns True if the playlist was saved.'''
+        if playlist is None:
+            playlist = self.playlist
+        tmppath = None
+        try:
+            fd, tmppath = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)),
+                prefix='.' + os.path.basename(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=["Name", "Description", "url"],
+                                        extrasaction='ignore')
+                writer.writeheader()
+                for count, row in enumerate(playlist, 1):
+                    writer.writerow(row)
+                    if count % IO_CHUNK_ROWS == 0:
+                        if cancel is not None and cancel.is_set():
+                            logger.debug('Playlist save cancelled.')
+                            return False
+                        if progress is not None:
+                            progress(count)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                shutil.copymode(path, tmppath)
+            else:
+                # mkstemp makes the file private; use the usual default.
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmppath, 0o666 & ~umask)
+            os.replace(tmppath, path)
+            if progress is not None:
+                progress(len(playlist))
+            return True
+        except (OSError, ValueError, csv.Error) as e:
+            logger.error('Can not save playlist to %s: %s', path, e)
+            return False
+        finally:
+            if tmppath is not None and os.path.exists(tmppath):
+                os.remove(tmppath)
+
     def save_playlist(self):
-        '''Ask the user to suggest where to save the current playlist'''
+        '''Ask the user to suggest where to save the current playlist.
+
+        Returns a started PlaylistWorker that does the saving, or None if
+        no file was chosen.'''
         d = os.getcwd() if self.pldir is None else self.pldir
         opts = {'initialdir':d,
                 'filetypes' :(("CSV File", "*.csv"),
                               ("Text File", "*.txt"),
                               ("All Files", "*.*")),
                 'defaultextension' : '.csv'}
-        plylst_path = asksaveasfilename(opts)
-        try:
-            with open(plylst_path, 'w') as f:
-                writer = csv.DictWriter(f, fieldnames=["Name", "Description", "url"])
-                for row in self.playlist:
-                    writer.writerow(row)
-        except FileNotFoundError:
-            logger.error('File Not Found:', plylst_path)
-            showwarning('File Error', 'Requested File not found')
+        plylst_path = asksaveasfilename(**opts)
+        if not plylst_path:
+            return None
+        # Save a snapshot, so the worker never sees a half edited list.
+        worker = PlaylistWorker('Saving', self.playlist_to_path,
+                                plylst_path, list(self.playlist))
+        worker.start()
+        return worker
 
     def select_playlist(self):
-        '''Ask the user to select a playlist and attempt to load it'''
+        '''Ask the user to select a playlist and start loading it.
+
+        Returns a started PlaylistWorker whose result is the loaded playlist,
+        or None if no file was chosen.  The active playlist is NOT altered.'''
         d = os.getcwd() if self.pldir is None else self.pldir
         opts = {'initialdir':d,
                 'filetypes' :(("CSV File", "*.csv"),
@@ -343,15 +472,133 @@ class Playlist_manager():
                 'defaultextension' : '.csv'}
         plylst_path = askopenfilename(**opts)
         if os.path.isfile(plylst_path):
-            self.playlist = self.playlist_from_path(plylst_path)
-            return True
+            worker = PlaylistWorker('Loading', self.playlist_from_path,
+                                    plylst_path)
+            worker.start()
+            return worker
         else:
-            return False
+            return None
 
     def edit_playlist(self):
         '''Edit the current playlist via popup dialogs'''
         SelectItemDialog(None, self.playlist)
 
+    def sync_playlist(self):
+        '''Check the subscribed playlist for changes and apply them.
+        Returns True if the active playlist was altered.
+
+        This waits on the server; the GUI uses start_sync instead.'''
+        rows = self.fetch_playlist()
+        if rows is None:
+            return False
+        return bool(self.apply_rows(rows))
+
+    def start_sync(self):
+        '''Start fetching the subscribed playlist off the Tk thread.
+
+        Returns a started PlaylistWorker whose result is the new rows, or
+        None if there is nothing to apply.  Pass the rows to apply_rows from
+        the Tk thread.'''
+        worker = PlaylistWorker('Syncing', self.fetch_playlist)
+        worker.start()
+        return worker
+
+    def fetch_playlist(self, progress=None, cancel=None):
+        '''Fetch the subscribed playlist, if it has changed on the server.
+
+        Uses a conditional GET (ETag / Last-Modified), so an unchanged
+        playlist costs a single "304 Not Modified" response.  A fresh copy
+        is written to the local cache and its rows are returned.  Returns
+        None if the playlist is unchanged, or the server can not be reached
+        or did not send a playlist.  The active playlist is NOT altered, so
+        this is safe to run on a PlaylistWorker.'''
+        if self.url is None:
+            return None
+        meta = self._read_sync_meta()
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            with urlopen(Request(self.url, headers=headers),
+                         timeout=SYNC_TIMEOUT) as response:
+                body = response.read().decode('utf-8-sig')
+                meta = {'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified')}
+            rdr = csv.DictReader(io.StringIO(body))
+            if not {"Name", "Description", "url"}.issubset(rdr.fieldnames or []):
+                logger.warning('Playlist server did not send a playlist.')
+                return None
+            rows = list(rdr)
+        except HTTPError as e:
+            if e.code == 304:
+                logger.debug('Subscribed playlist not modified.')
+            else:
+                logger.warning('Playlist server returned %s.', e.code)
+            return None
+        except (URLError, OSError, HTTPException) as e:
+            logger.warning('Can not reach playlist server: %s', e)
+            return None
+        except (UnicodeDecodeError, csv.Error):
+            logger.warning('Can not read playlist sent by server.')
+            return None
+
+        if cancel is not None and cancel.is_set():
+            return None
+        # Only keep the new validators once the cache holds the matching
+        # copy, or a stale cache would be "not modified" from then on.
+        if self.playlist_to_path(self.cachepath, rows):
+            self._write_sync_meta(meta)
+        logger.debug('Fetched subscribed playlist, %d rows.', len(rows))
+        return rows
+
+    def apply_rows(self, rows):
+        '''Merge rows into the active playlist, matching rows on "Name".
+
+        Rows that are unchanged are left alone, so the playlist list and the
+        dictionaries it holds keep their identity.
+        Returns the number of rows added, altered or removed.'''
+        if self.playlist is None:
+            self.playlist = []
+        current = {row['Name']: row for row in self.playlist}
+        merged = []
+        changed = 0
+        for row in rows:
+            old = current.pop(row['Name'], None)
+            if old is None:
+                merged.append(row)
+                changed += 1
+            else:
+                if old != row:
+                    old.update(row)
+                    changed += 1
+                merged.append(old)
+        changed += len(current)     # rows dropped from the server copy
+        if changed or [r['Name'] for r in merged] != \
+                      [r['Name'] for r in self.playlist]:
+            self.playlist[:] = merged
+            changed = max(changed, 1)
+        return changed
+
+    def _read_sync_meta(self):
+        '''Return the validators saved from the last successful sync.'''
+        # Without a cached copy, the validators are useless.
+        if not os.path.isfile(self.cachepath):
+            return {}
+        try:
+            with open(self.metapath, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_sync_meta(self, meta):
+        try:
+            with open(self.metapath, 'w') as f:
+                json.dump(meta, f)
+        except IOError:
+            logger.warning('Can not write playlist cache information.')
+
 
 class Controls(tk.Frame):
     """Simple tkinter-based GUI"""
@@ -370,10 +617,15 @@ class Controls(tk.Frame):
         self.ischanged = False       # is playlist altered?  Not clear if this
                                      # is best place o store this
         self.active = 0   # for now, default to first item in the list.
+        self.subscribed = self.manager.url is not None  # showing shared list?
+        self.worker = None   # PlaylistWorker for a load or save in progress
+        self.sync_worker = None   # PlaylistWorker fetching the shared list
+        self.closing = False # saving the playlist on the way out?
         self._gui()
         self.bind("<Map>",self.frame_mapped)
         self.change()     # This fires up the player with the current selection
-
+        if self.subscribed:
+            self._sync_playlist()
 
 
     def _gui(self):
@@ -432,13 +684,13 @@ class Controls(tk.Frame):
         minimizebutton.bind("<Enter>", hover)
         minimizebutton.bind("<Leave>", unHover)
 
-        listbutton = tk.Button(top_toolbar, text="Select Playlist",
-                               width=20, command=self._change_playlist,
-                               bg=THMCOLOR)
-        listbutton.grid(column=0, row=2, padx=6, pady=2,
-                        sticky=tk.W+tk.E)
-        listbutton.bind("<Enter>", hover)
-        listbutton.bind("<Leave>", unHover)
+        self.listbutton = tk.Button(top_toolbar, text="Select Playlist",
+                                    width=20, command=self._change_playlist,
+                                    bg=THMCOLOR)
+        self.listbutton.grid(column=0, row=2, padx=6, pady=2,
+                             sticky=tk.W+tk.E)
+        self.listbutton.bind("<Enter>", hover)
+        self.listbutton.bind("<Leave>", unHover)
         
         editbutton = tk.Button(top_toolbar, text="Manage Playlist",
                                width=20, command=self._edit_playlist,
@@ -519,9 +771,34 @@ class Controls(tk.Frame):
 
     def Quit(self):
         ''''Quit the Application'''
+        if self.worker is not None:
+            # Don't wait on a slow load or save.  The worker stops at the end
+            # of its current chunk, or dies with the program, and an
+            # interrupted save leaves the old file intact.
+            self.worker.cancel()
+            if self.closing:     # Quit again while saving on the way out
+                self._close()
+                return
         if self.ischanged:
             if askokcancel("Playlist has been altered", "Save current playlist?"):
-                self.manager.save_playlist()
+                worker = self.manager.save_playlist()
+                if worker is not None:
+                    self.closing = True
+                    self._run_io(worker, self._saved_then_close)
+                    return
+        self._close()
+
+    def _saved_then_close(self, worker):
+        if worker.cancelled.is_set():
+            # Cancel Saving keeps the window open, edits still unsaved.
+            self.closing = False
+            return
+        if worker.result is not True:
+            showwarning('File Error', 'Could not save the playlist')
+        self._close()
+
+    def _close(self):
+        '''Shut down the Player and close the window'''
         self.player.close()
         m = self.master
         self.destroy()
@@ -568,15 +845,64 @@ class Controls(tk.Frame):
 
     def _change_playlist(self):
         ''' Dispatch change playlist command to the List Manager'''
-        if self.manager.select_playlist():
-            self.plst = self.manager.playlist
-            self.listbox.delete(0, tk.END)
-            for item in self.plst:
-                self.listbox.insert(tk.END, item['Name'])
-            self.ischanged = False
+        worker = self.manager.select_playlist()
+        if worker is not None:
+            self._run_io(worker, self._playlist_loaded)
+
+    def _playlist_loaded(self, worker):
+        '''Show a playlist once the List Manager has loaded it'''
+        if worker.cancelled.is_set():
+            return
+        if worker.result is None:
+            showwarning('File Error', 'Could not read the playlist')
+            return
+        self.manager.playlist = worker.result
+        self.plst = self.manager.playlist
+        self.listbox.delete(0, tk.END)
+        for item in self.plst:
+            self.listbox.insert(tk.END, item['Name'])
+        self.ischanged = False
+        self.subscribed = False
+
+    def _run_io(self, worker, on_done):
+        '''Watch a running PlaylistWorker, calling on_done(worker) at the end.
+
+        While it runs, the Select Playlist button cancels the job.'''
+        self.worker = worker
+        self.listbutton.config(text='Cancel ' + worker.label,
+                               command=self._cancel_io)
+        self.after(IO_POLL_INTERVAL, self._poll_io, worker, on_done)
+
+    def _poll_io(self, worker, on_done):
+        '''Report progress from a PlaylistWorker until it is done'''
+        while True:
+            try:
+                kind, value = worker.messages.get_nowait()
+            except queue.Empty:
+                self.after(IO_POLL_INTERVAL, self._poll_io, worker, on_done)
+                return
+            if kind == 'done':
+                break
+            if self.worker is worker:
+                self.topbar.config(text='%s... %d stations' % (worker.label,
+                                                                 value))
+        # A cancelled job may finish after Quit has started a save.
+        if self.worker is worker:
+            self.worker = None
+            self.topbar.config(text='Simple Streaming Radio')
+            self.listbutton.config(text='Select Playlist',
+                                   command=self._change_playlist)
+        on_done(worker)
+
+    def _cancel_io(self):
+        ''' Cancel the playlist load or save in progress'''
+        if self.worker is not None:
+            self.worker.cancel()
 
     def _edit_playlist(self):
         ''' Dispatch edit playlist command to the list manager'''
+        if self.worker is not None:
+            return
         self.manager.edit_playlist()
         if askokcancel("Confirm", "Keep playlist changes?"):
             self.plst = self.manager.playlist
@@ -585,6 +911,42 @@ class Controls(tk.Frame):
                 self.listbox.insert(tk.END, item['Name'])
             self.ischanged = True
 
+    def _sync_playlist(self):
+        ''' Periodically check the subscribed playlist for updates'''
+        # Don't clobber local edits, or a playlist the user switched to.
+        # The sync runs on its own worker, so it never ties up the
+        # Select Playlist button or blocks editing.
+        if self.subscribed and not self.ischanged and self.sync_worker is None:
+            self.sync_worker = self.manager.start_sync()
+            self.after(IO_POLL_INTERVAL, self._poll_sync)
+        self.after(SYNC_INTERVAL, self._sync_playlist)
+
+    def _poll_sync(self):
+        '''Wait for the shared playlist fetch to finish'''
+        if self.sync_worker.is_alive():
+            self.after(IO_POLL_INTERVAL, self._poll_sync)
+            return
+        worker = self.sync_worker
+        self.sync_worker = None
+        self._playlist_synced(worker)
+
+    def _playlist_synced(self, worker):
+        '''Merge a freshly fetched shared playlist into the listbox'''
+        # The cache already holds any rows returned, so they are never
+        # thrown away unless the user has moved off the shared list.
+        if worker.result is None:
+            return
+        if not self.subscribed or self.ischanged:
+            return
+        if self.manager.apply_rows(worker.result):
+            self.listbox.delete(0, tk.END)
+            for item in self.plst:
+                self.listbox.insert(tk.END, item['Name'])
+            if self.plst:
+                self.listbox.select_set(min(self.active, len(self.plst) - 1))
+                if not self.player.is_playing():   # Started with no cache
+                    self.change()
+
     def change(self):
         '''Dispatch request to player to play current selection.
 
@@ -657,7 +1019,7 @@ class Player():
 
 #TODO:  Refactor to bring playlist controls into the main interface
 def start():
-    plmgr = Playlist_manager(PLYLISTFN)
+    plmgr = Playlist_manager(PLYLISTFN, url=PLYLISTURL)
 
     plyr = Player()
     
@@ -678,4 +1040,5 @@ def start():
 
     gui.mainloop()
 
-start()
+if __name__ == '__main__':
+    start()
@@ -0,0 +1,180 @@
+"""Background playlist load and save, against an artificially slow filesystem."""
+import builtins
+import os
+import time
+
+import pytest
+
+import radiostreamer as rs
+
+HEADER = 'Name,Description,url\n'
+
+
+def make_playlist(path, nrows):
+    with open(path, 'w', newline='') as f:
+        f.write(HEADER)
+        for i in range(nrows):
+            f.write('Station %d,Description %d,http://example.com/%d\n' % (i, i, i))
+
+
+class SlowFile():
+    '''Wraps a real file, sleeping on every line read or written.'''
+    def __init__(self, f, delay, fail_after=None):
+        self.f = f
+        self.delay = delay
+        self.fail_after = fail_after
+        self.writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        time.sleep(self.delay)
+        return next(self.f)
+
+    def write(self, s):
+        time.sleep(self.delay)
+        self.writes += 1
+        if self.fail_after is not None and self.writes > self.fail_after:
+            raise OSError(28, 'No space left on device')
+        return self.f.write(s)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+@pytest.fixture
+def slow_open(monkeypatch):
+    def _open(path, mode='r', **kwds):
+        return SlowFile(builtins.open(path, mode, **kwds), 0.002)
+    monkeypatch.setattr(rs, 'open', _open, raising=False)
+
+
+def slow_fdopen(monkeypatch, fail_after=None):
+    real_fdopen = os.fdopen
+    def _fdopen(fd, *args, **kwds):
+        return SlowFile(real_fdopen(fd, *args, **kwds), 0.002, fail_after)
+    monkeypatch.setattr(rs.os, 'fdopen', _fdopen)
+
+
+def drain(worker):
+    messages = []
+    while not worker.messages.empty():
+        messages.append(worker.messages.get())
+    return messages
+
+
+def wait_for_progress(worker, timeout=5):
+    kind, value = worker.messages.get(timeout=timeout)
+    assert kind == 'progress'
+    return value
+
+
+@pytest.fixture
+def manager(tmp_path):
+    make_playlist(tmp_path / 'plylist.csv', 3)
+    return rs.Playlist_manager('plylist.csv', fdir=str(tmp_path))
+
+
+def test_load_reports_progress_each_chunk(tmp_path, manager, slow_open):
+    path = str(tmp_path / 'big.csv')
+    make_playlist(path, 2 * rs.IO_CHUNK_ROWS + 50)
+    worker = rs.PlaylistWorker('Loading', manager.playlist_from_path, path)
+    worker.start()
+    worker.join(timeout=10)
+
+    messages = drain(worker)
+    progress = [value for kind, value in messages if kind == 'progress']
+    assert progress == [rs.IO_CHUNK_ROWS, 2 * rs.IO_CHUNK_ROWS,
+                        2 * rs.IO_CHUNK_ROWS + 50]
+    kind, rows = messages[-1]
+    assert kind == 'done'
+    assert len(rows) == 2 * rs.IO_CHUNK_ROWS + 50
+    assert rows[0] == {'Name': 'Station 0', 'Description': 'Description 0',
+                       'url': 'http://example.com/0'}
+
+
+def test_cancelled_load_returns_none(tmp_path, manager, slow_open):
+    path = str(tmp_path / 'big.csv')
+    make_playlist(path, 20 * rs.IO_CHUNK_ROWS)
+    worker = rs.PlaylistWorker('Loading', manager.playlist_from_path, path)
+    worker.start()
+    wait_for_progress(worker)
+    worker.cancel()
+    worker.join(timeout=10)
+
+    assert not worker.is_alive()
+    assert worker.result is None
+    assert drain(worker)[-1] == ('done', None)
+
+
+def leftover_tmp_files(directory):
+    return [fn for fn in os.listdir(directory) if fn.endswith('.tmp')]
+
+
+def test_cancelled_save_leaves_target_alone(tmp_path, manager, monkeypatch):
+    target = tmp_path / 'plylist.csv'
+    before = target.read_bytes()
+    rows = [{'Name': 'n%d' % i, 'Description': 'd', 'url': 'u'}
+            for i in range(20 * rs.IO_CHUNK_ROWS)]
+    slow_fdopen(monkeypatch)
+    worker = rs.PlaylistWorker('Saving', manager.playlist_to_path,
+                               str(target), rows)
+    worker.start()
+    wait_for_progress(worker)
+    worker.cancel()
+    worker.join(timeout=10)
+
+    assert worker.result is False
+    assert target.read_bytes() == before
+    assert leftover_tmp_files(str(tmp_path)) == []
+
+
+def test_failed_save_leaves_target_alone(tmp_path, manager, monkeypatch):
+    target = tmp_path / 'plylist.csv'
+    before = target.read_bytes()
+    rows = [{'Name': 'n%d' % i, 'Description': 'd', 'url': 'u'}
+            for i in range(3 * rs.IO_CHUNK_ROWS)]
+    slow_fdopen(monkeypatch, fail_after=rs.IO_CHUNK_ROWS)
+
+    assert manager.playlist_to_path(str(target), rows) is False
+    assert target.read_bytes() == before
+    assert leftover_tmp_files(str(tmp_path)) == []
+
+
+def test_save_round_trips(tmp_path, manager):
+    target = str(tmp_path / 'copy.csv')
+    assert manager.playlist_to_path(target) is True
+    assert manager.playlist_from_path(target) == manager.playlist
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX file modes')
+def test_new_file_follows_umask(tmp_path, manager):
+    umask = os.umask(0o022)
+    try:
+        target = str(tmp_path / 'new.csv')
+        assert manager.playlist_to_path(target) is True
+    finally:
+        os.umask(umask)
+    assert os.stat(target).st_mode & 0o777 == 0o644
+
+
+def test_workers_do_not_block_exit(manager):
+    worker = rs.PlaylistWorker('Loading', manager.playlist_from_path,
+                               manager.plpath)
+    assert worker.daemon
+
+
+def test_unencodable_save_fails_cleanly(tmp_path, manager):
+    target = tmp_path / 'plylist.csv'
+    before = target.read_bytes()
+    rows = [{'Name': 'Bad \ud800', 'Description': 'd', 'url': 'u'}]
+    assert manager.playlist_to_path(str(target), rows) is False
+    assert target.read_bytes() == before
+    assert leftover_tmp_files(str(tmp_path)) == []
@@ -0,0 +1,201 @@
+"""Shared playlist sync, against a local stand-in playlist server."""
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import radiostreamer as rs
+
+PLAYLIST = (b'Name,Description,url\n'
+            b'Jazz,Jazz station,http://example.com/jazz\n'
+            b'Folk,Folk station,http://example.com/folk\n')
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    '''Serves server.body, honouring If-None-Match.'''
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        etag = '"%d"' % self.server.version
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length',
+                         str(len(self.server.body) + self.server.missing))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Mon, 19 Oct 2026 0%d:00:00 GMT'
+                         % self.server.version)
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = HTTPServer(('127.0.0.1', 0), PlaylistHandler)
+    srv.body = PLAYLIST
+    srv.version = 1
+    srv.missing = 0      # bytes promised but never sent
+    srv.requests = []
+    srv.url = 'http://127.0.0.1:%d/plylist.csv' % srv.server_port
+    thread = threading.Thread(target=srv.serve_forever, args=(0.05,),
+                              daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def publish(server, body):
+    server.body = body
+    server.version += 1
+
+
+def unused_url():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return 'http://127.0.0.1:%d/plylist.csv' % port
+
+
+def test_startup_does_not_wait_for_server(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    assert manager.playlist == []
+    assert server.requests == []
+
+
+def test_first_fetch_writes_cache_and_validators(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    assert manager.sync_playlist() is True
+    assert [row['Name'] for row in manager.playlist] == ['Jazz', 'Folk']
+
+    assert manager.playlist_from_path(manager.cachepath) == manager.playlist
+    with open(manager.metapath) as f:
+        meta = json.load(f)
+    assert meta['etag'] == '"1"'
+    assert meta['last_modified'] == 'Mon, 19 Oct 2026 01:00:00 GMT'
+
+
+def test_unchanged_playlist_is_not_modified(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    manager.sync_playlist()
+    before = [dict(row) for row in manager.playlist]
+
+    assert manager.sync_playlist() is False
+    headers = server.requests[-1]
+    assert headers['If-None-Match'] == '"1"'
+    assert headers['If-Modified-Since'] == 'Mon, 19 Oct 2026 01:00:00 GMT'
+    assert manager.playlist == before
+
+
+def test_changed_row_is_updated_in_place(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    manager.sync_playlist()
+    playlist = manager.playlist
+    jazz, folk = playlist
+
+    publish(server, PLAYLIST.replace(b'Folk station', b'Folk and roots'))
+    assert manager.sync_playlist() is True
+    assert manager.playlist is playlist
+    assert manager.playlist[0] is jazz
+    assert manager.playlist[1] is folk
+    assert folk['Description'] == 'Folk and roots'
+    assert jazz['Description'] == 'Jazz station'
+
+
+def test_unreachable_server_starts_from_cache(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    manager.sync_playlist()
+
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=unused_url())
+    assert [row['Name'] for row in manager.playlist] == ['Jazz', 'Folk']
+    assert manager.sync_playlist() is False
+    assert [row['Name'] for row in manager.playlist] == ['Jazz', 'Folk']
+
+
+def test_background_sync(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    worker = manager.start_sync()
+    worker.join(timeout=10)
+    assert manager.playlist == []         # Nothing applied off the Tk thread
+    assert manager.apply_rows(worker.result)
+    assert [row['Name'] for row in manager.playlist] == ['Jazz', 'Folk']
+
+
+@pytest.mark.parametrize('body', [
+    b'<html>\n<body>gateway error</body>\n</html>\n',
+    b'<html><body>gateway error</body></html>\n',
+    b'Name,Description,url\nCaf\xe9,Not UTF-8,http://example.com/\n',
+])
+def test_bad_response_keeps_cache(tmp_path, server, body):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    manager.sync_playlist()
+    with open(manager.cachepath, 'rb') as f:
+        cache = f.read()
+
+    publish(server, body)
+    assert manager.sync_playlist() is False
+    assert [row['Name'] for row in manager.playlist] == ['Jazz', 'Folk']
+    with open(manager.cachepath, 'rb') as f:
+        assert f.read() == cache
+    with open(manager.metapath) as f:
+        assert json.load(f)['etag'] == '"1"'
+
+
+def test_validators_wait_for_cache(tmp_path, server, monkeypatch):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    manager.sync_playlist()
+
+    publish(server, PLAYLIST.replace(b'Folk station', b'Folk and roots'))
+    monkeypatch.setattr(manager, 'playlist_to_path',
+                        lambda *args, **kwds: False)
+    manager.sync_playlist()
+    with open(manager.metapath) as f:
+        assert json.load(f)['etag'] == '"1"'
+
+    monkeypatch.undo()
+    manager.sync_playlist()
+    with open(manager.metapath) as f:
+        assert json.load(f)['etag'] == '"2"'
+    cached = manager.playlist_from_path(manager.cachepath)
+    assert cached[1]['Description'] == 'Folk and roots'
+
+
+def test_truncated_response_keeps_cache(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    manager.sync_playlist()
+
+    publish(server, PLAYLIST.replace(b'Folk station', b'Folk and roots'))
+    server.missing = 100
+    assert manager.sync_playlist() is False
+    assert manager.playlist[1]['Description'] == 'Folk station'
+    with open(manager.metapath) as f:
+        assert json.load(f)['etag'] == '"1"'
+
+
+def test_cache_is_utf8(tmp_path, server):
+    publish(server, PLAYLIST.replace(b'Jazz,', 'Radio Łódź,'.encode('utf-8')))
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    assert manager.sync_playlist() is True
+    with open(manager.cachepath, 'rb') as f:
+        assert 'Radio Łódź'.encode('utf-8') in f.read()
+
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=unused_url())
+    assert manager.playlist[0]['Name'] == 'Radio Łódź'
+
+
+def test_cancelled_fetch_leaves_cache_alone(tmp_path, server):
+    manager = rs.Playlist_manager(fdir=str(tmp_path), url=server.url)
+    worker = manager.start_sync()
+    worker.cancel()
+    worker.join(timeout=10)
+    assert worker.result is None
+    assert not os.path.exists(manager.cachepath)